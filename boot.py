@@ -39,7 +39,13 @@ try:
 except Exception as e:
     print("Boot Key Error:", e)
 
-# 2. STORAGE CONTROL
+# 2. USB SERIAL: console plus a data channel for tools/pbxfer.py
+try:
+    usb_cdc.enable(console=True, data=True)
+except Exception as e:
+    print("USB CDC Error:", e)
+
+# 3. STORAGE CONTROL
 if pressed:
     print(">> Maintenance Mode: Drive Enabled")
     storage.enable_usb_drive()
@@ -16,6 +16,10 @@ import struct
 import json
 import digitalio
 import alarm
+import binascii
+import errno
+import zlib
+import usb_cdc
 
 # --- GLOBAL VARS ---
 kb = None
@@ -23,14 +27,95 @@ term = None
 REPL_ENV = {}
 SYSTEM_CONFIG = {}
 SD_HARDWARE = {"spi": None, "cs": None, "sd": None, "vfs": None}
+ACL = {}
+LOG_STATE = {"ring": [], "idx": 0, "pending": 0, "flushed": 0.0}
+XFER_STATE = {"rx": None, "n": 0, "mode": None, "t": 0.0}
+CRON = {"jobs": [], "heap": []}
+POWER_STATE = {"mode": "active", "last": 0.0, "level": 1.0}
+WIFI_STATE = {"up": False, "next": 0.0, "backoff": 2}
 
 # --- SETTINGS ---
 HIDDEN_FILES = ["code.py", "boot.py", "lib", "config.json", "System Volume Information"]
-PROTECTED_PATHS = ["/code.py", "/boot.py", "/lib", "/config.json"]
+PROTECTED_PATHS = ["/code.py", "/boot.py", "/lib", "/config.json", "/crontab"]
+# Base rules for every non-root user; SYSTEM_CONFIG["acl"][user] is layered on top.
+# "~" expands to the user's home. Perms: "rw", "r" or "-".
+DEFAULT_ACL = [["/", "r"]] + [[p, "-"] for p in PROTECTED_PATHS] + [["/sd", "rw"], ["~", "rw"]]
+BATTERY_MAH = 1750
+COPY_BUF = 2048
+SYNC_INDEX = ".syncindex"
+GZ_WBITS = 10        # 1 KB compression window keeps RAM bounded on both ends
+GZ_INLINE_MAX = 16384  # one-shot inflate limit when the firmware has no streaming API
+LOG_SIZE = 64
+LOG_FLUSH_LINES = 16
+LOG_FLUSH_SECS = 60
+LOG_DIR = "/sd/log"
+LOG_MAX_BYTES = 32768
+LOG_KEEP = 3
+CRONTAB = "/crontab"  # root-only: jobs can run as any user
+WIFI_FAST_TIMEOUT = 4
+WIFI_SCAN_TIMEOUT = 5
+WIFI_IDLE_SECS = 3   # only block on connect/scan once the keyboard has been quiet this long
+WIFI_BACKOFF_MAX = 300
+SWEEP_PARALLEL = 16
+SWEEP_PORT = 80
+SWEEP_ISCONN = getattr(errno, "EISCONN", 106)  # not every port's errno module has it
+SERVE_PORT = 8080
+SERVE_BUF = 4096
+# USB CDC transfer frame: A5 5A | kind u8 | seq u32 | len u16 | payload | crc32 (LE)
+XFER_CHUNK = 512
+XFER_WINDOW = 8
+XFER_BUF = 4096
+XFER_TIMEOUT = 1.0
+XFER_RETRIES = 5
+XFER_WRITE_TIMEOUT = 0.5  # a host that stops reading must not stall the shell
+# Rough draw estimates (mA) per power mode for a Cardputer ADV with WiFi idle
+POWER_DRAW_MA = {"active": 110, "dim": 80, "sleep": 25}
+
+# --- KERNEL LOG ---
+def klog(msg, color=None):
+    """Append to the in-RAM ring buffer; echo to the console when a color is given."""
+    ring = LOG_STATE["ring"]
+    line = f"[{time.monotonic():9.2f}] {msg}"
+    if len(ring) < LOG_SIZE: ring.append(line)
+    else: ring[LOG_STATE["idx"]] = line
+    LOG_STATE["idx"] = (LOG_STATE["idx"] + 1) % LOG_SIZE
+    LOG_STATE["pending"] = min(LOG_STATE["pending"] + 1, LOG_SIZE)
+    if color is not None and term: term.print(msg, color)
+
+def log_lines(last=LOG_SIZE):
+    ring = LOG_STATE["ring"]
+    start = LOG_STATE["idx"] if len(ring) == LOG_SIZE else 0
+    return [ring[(start + i) % len(ring)] for i in range(len(ring) - min(last, len(ring)), len(ring))]
+
+def log_flush(force=False):
+    """Append unflushed lines to LOG_DIR/kern.log in one write, rotating past LOG_MAX_BYTES."""
+    n = LOG_STATE["pending"]
+    if not n: return
+    if not force and n < LOG_FLUSH_LINES and time.monotonic() - LOG_STATE["flushed"] < LOG_FLUSH_SECS: return
+    LOG_STATE["flushed"] = time.monotonic()
+    if not SD_HARDWARE["vfs"]: return
+    path = LOG_DIR + "/kern.log"
+    try:
+        try: os.mkdir(LOG_DIR)
+        except OSError: pass
+        try: size = os.stat(path)[6]
+        except OSError: size = 0
+        if size > LOG_MAX_BYTES:
+            for i in range(LOG_KEEP - 1, 0, -1):
+                try:
+                    if i == LOG_KEEP - 1: os.remove(f"{path}.{i}")
+                    else: os.rename(f"{path}.{i}", f"{path}.{i+1}")
+                except OSError: pass
+            os.rename(path, path + ".1")
+        with open(path, "a") as f: f.write("\n".join(log_lines(n)) + "\n")
+        LOG_STATE["pending"] = 0
+    except OSError: pass
 
 # --- RECOVERY MODE ---
 def recovery_mode(error_msg):
     print(f"\nCRASH: {error_msg}")
+    klog(f"CRASH: {error_msg}")
+    log_flush(force=True)
     global kb, term
     try:
         if not kb:
@@ -123,12 +208,17 @@ def virtual_input(prompt=""):
         time.sleep(0.01)
 
 # --- CORE KERNEL LOGIC ---
+def user_home(user):
+    if user == "root": return globals()['ROOT_HOME']
+    if user == "guest": return globals()['GUEST_HOME']
+    return f"/home/{user}"
+
 def update_prompt():
     c_user = globals()['CURRENT_USER']
     cwd = globals()['CWD']
     color = 0xFF5555 if c_user == "root" else 0x00FFFF
     globals()['PROMPT_CHAR'] = "#" if c_user == "root" else "$"
-    home = globals()['ROOT_HOME'] if c_user == "root" else globals()['GUEST_HOME']
+    home = user_home(c_user)
     if cwd.startswith(home): cwd = "~" + cwd[len(home):]
     term.label_prompt.color = color
     term.label_prompt.text = f"{c_user} {cwd} {globals()['PROMPT_CHAR']} "
@@ -138,8 +228,7 @@ def resolve_path(path):
     cwd = globals()['CWD']
     if path == "/": return "/"
     if path.startswith("~"):
-        home = globals()['ROOT_HOME'] if globals()['CURRENT_USER'] == "root" else globals()['GUEST_HOME']
-        path = home + path[1:]
+        path = user_home(globals()['CURRENT_USER']) + path[1:]
     target = path if path.startswith("/") else (cwd + "/" + path if cwd != "/" else "/" + path)
     parts = [p for p in target.split("/") if p != ""]
     final = []
@@ -157,22 +246,121 @@ def is_dir(path):
     try: return (os.stat(path)[0] & 0x4000) != 0
     except: return False
 
-def check_access(path, write_mode=False):
+def acl_rules(user):
+    return DEFAULT_ACL + SYSTEM_CONFIG.get("acl", {}).get(user, [])
+
+def compile_acl(user):
+    """Build the prefix trie for user; the deepest matching node's "." perm wins."""
+    global ACL
+    home = user_home(user)
+    trie = {}
+    for path, perm in acl_rules(user):
+        if path.startswith("~"): path = home + path[1:]
+        node = trie
+        for part in path.split("/"):
+            if part: node = node.setdefault(part, {})
+        node["."] = perm
+    ACL = trie
+
+def acl_lookup(path):
+    node = ACL
+    perm = node.get(".", "-")
+    for part in path.split("/"):
+        if not part: continue
+        node = node.get(part)
+        if node is None: break
+        perm = node.get(".", perm)
+    return perm
+
+def copy_file(src, dst, buf):
+    """Stream src to dst through buf; returns (bytes, crc32) of the data copied."""
+    mv = memoryview(buf); total = 0; crc = 0
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        while True:
+            n = s.readinto(buf)
+            if not n: break
+            d.write(mv[:n]); crc = binascii.crc32(mv[:n], crc); total += n
+    return total, crc
+
+def file_crc(path, buf):
+    mv = memoryview(buf); crc = 0
+    with open(path, "rb") as f:
+        while True:
+            n = f.readinto(buf)
+            if not n: break
+            crc = binascii.crc32(mv[:n], crc)
+    return crc
+
+def gz_chunks(path, buf):
+    """Yield the decompressed contents of a gzip file piece by piece."""
+    mv = memoryview(buf)
+    with open(path, "rb") as f:
+        if hasattr(zlib, "decompressobj"):
+            d = zlib.decompressobj(31)
+            while True:
+                n = f.readinto(buf)
+                if not n: break
+                out = d.decompress(bytes(mv[:n]))
+                if out: yield out
+            yield d.flush()
+            return
+        try: import deflate
+        except ImportError: deflate = None
+        if deflate:
+            g = deflate.DeflateIO(f, deflate.GZIP)
+            while True:
+                n = g.readinto(buf)
+                if not n: break
+                yield bytes(mv[:n])
+            return
+        if os.stat(path)[6] > GZ_INLINE_MAX: raise OSError("gz too large to inflate")
+        yield zlib.decompress(f.read(), 31)
+
+def gz_compress(src, dst, buf):
+    """Stream src into a gzip file at dst; returns bytes written."""
+    mv = memoryview(buf)
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        if hasattr(zlib, "compressobj"):
+            c = zlib.compressobj(9, zlib.DEFLATED, 16 + GZ_WBITS)
+            while True:
+                n = s.readinto(buf)
+                if not n: break
+                d.write(c.compress(bytes(mv[:n])))
+            d.write(c.flush())
+        else:
+            try: import deflate
+            except ImportError: raise OSError("no compressor in firmware")
+            g = deflate.DeflateIO(d, deflate.GZIP, GZ_WBITS)
+            while True:
+                n = s.readinto(buf)
+                if not n: break
+                g.write(mv[:n])
+            g.close()
+    return os.stat(dst)[6]
+
+def read_text(path):
+    """Read a text file, inflating .gz files transparently."""
+    if not path.endswith(".gz"):
+        with open(path, "r") as f: return f.read()
+    # Decode once at the end: a multi-byte character may straddle two chunks
+    return str(b"".join(gz_chunks(path, bytearray(COPY_BUF))), "utf-8")
+
+def make_dirs(path):
+    cur = ""
+    for part in path.split("/"):
+        if not part: continue
+        cur += "/" + part
+        if not is_dir(cur): os.mkdir(cur)
+
+def check_access(path, write_mode=False, quiet=False):
     """Central Security Check"""
-    user = globals()['CURRENT_USER']
-    if user == "root": return True
-    
-    # 1. System File Protection
-    for protected in PROTECTED_PATHS:
-        if path == protected or path.startswith(protected + "/"):
-            term.print("Permission Denied (System)", 0xFF0000)
-            return False
-            
-    # 2. Write Protection
-    if write_mode:
-        if path.startswith(globals()['GUEST_HOME']): return True
-        if path.startswith("/sd"): return True
-        term.print("Permission Denied (Write)", 0xFF0000)
+    if globals()['CURRENT_USER'] == "root": return True
+    perm = acl_lookup(path)
+    if "r" not in perm:
+        if not quiet: term.print("Permission Denied (Read)", 0xFF0000)
+        return False
+    if write_mode and "w" not in perm:
+        if not quiet: term.print("Permission Denied (Write)", 0xFF0000)
         return False
     return True
 
@@ -181,14 +369,14 @@ def find_executable(cmd_name):
         if file_exists(resolve_path(cmd_name)): return resolve_path(cmd_name)
         return None
     local = resolve_path(cmd_name)
-    if file_exists(local) and local.endswith(".pbash"): return local
+    if local.endswith(".pbash") and check_access(local, quiet=True) and file_exists(local): return local
     local_py = resolve_path(cmd_name if cmd_name.endswith(".py") else cmd_name + ".py")
-    if file_exists(local_py): return local_py
+    if check_access(local_py, quiet=True) and file_exists(local_py): return local_py
     clean = cmd_name[:-3] if cmd_name.endswith(".py") else cmd_name
     for folder in globals()['SYSTEM_PATH']:
         try:
             target = f"{folder}/{clean}.py"
-            if file_exists(target): return target
+            if check_access(target, quiet=True) and file_exists(target): return target
         except: continue
     return None
 
@@ -239,7 +427,7 @@ def run_command_line(cmd_str):
                     exec(f.read(), REPL_ENV)
                     if term.display.root_group != term.splash:
                         term.display.root_group = term.splash
-            except Exception as e: term.print(f"Exec Err: {e}", 0xFF0000)
+            except Exception as e: klog(f"Exec Err: {e}", 0xFF0000)
         return
     try:
         res = eval(cmd_str, REPL_ENV)
@@ -258,7 +446,7 @@ def run_script_file(path):
                 l = line.strip()
                 if l: run_command_line(l)
     except Exception as e:
-        term.print(f"Script Err: {e}", 0xFF0000)
+        klog(f"Script Err: {e}", 0xFF0000)
 
 # --- HARDWARE MANAGERS ---
 def mount_sd_card(verbose=False):
@@ -280,15 +468,16 @@ def mount_sd_card(verbose=False):
         SD_HARDWARE["vfs"] = storage.VfsFat(SD_HARDWARE["sd"])
         storage.mount(SD_HARDWARE["vfs"], "/sd")
         if verbose: term.print("Success!", 0x00FF00)
-        else: term.print("[INIT] SD Mounted", 0x00FF00)
+        else: klog("[INIT] SD Mounted", 0x00FF00)
         return True
     except Exception as e:
         if verbose: term.print(f"Err: {e}", 0xFF0000)
-        else: term.print(f"[INIT] No SD: {e}", 0x555555)
+        else: klog(f"[INIT] No SD: {e}", 0x555555)
     return False
 
 def unmount_sd_card(verbose=False):
     global SD_HARDWARE
+    log_flush(force=True)
     try:
         storage.umount("/sd")
         SD_HARDWARE["vfs"] = None
@@ -297,15 +486,68 @@ def unmount_sd_card(verbose=False):
     except Exception as e:
         if verbose: term.print(f"Unmount Err: {e}", 0xFF0000)
 
+def set_backlight(level):
+    try: term.display.brightness = level
+    except: pass
+
+def power_touch():
+    """Register user activity, restore the backlight and return the mode we left."""
+    prev = POWER_STATE["mode"]
+    if prev != "active": set_backlight(POWER_STATE["level"])
+    POWER_STATE["mode"] = "active"
+    POWER_STATE["last"] = time.monotonic()
+    return prev
+
+def power_idle():
+    """Idle scheduler: dims after conf['dim'] s, light sleeps after conf['sleep'] s.
+    Returns the key that woke the device from sleep, else None."""
+    conf = SYSTEM_CONFIG.get("power", {})
+    idle = time.monotonic() - POWER_STATE["last"]
+    mode = POWER_STATE["mode"]
+    if mode == "active" and conf.get("dim", 0) > 0 and idle >= conf["dim"]:
+        try: POWER_STATE["level"] = term.display.brightness
+        except: pass
+        set_backlight(conf.get("dim_level", 0.2))
+        POWER_STATE["mode"] = mode = "dim"
+    if mode != "sleep" and conf.get("sleep", 0) > 0 and idle >= conf["sleep"]:
+        if mode == "active":
+            try: POWER_STATE["level"] = term.display.brightness
+            except: pass
+        set_backlight(0)
+        POWER_STATE["mode"] = "sleep"
+        klog("Light sleep")
+        log_flush(force=True)
+        # The key matrix is owned by the keyboard driver, so wake on short timer
+        # alarms and scan between them. RAM and peripherals survive light sleep.
+        poll = conf.get("poll", 0.2)
+        while True:
+            alarm.light_sleep_until_alarms(alarm.time.TimeAlarm(monotonic_time=time.monotonic() + poll))
+            cron_tick()
+            c = kb.check()
+            if c: return c
+            # A pbxfer request wakes us too; the shell loop drives it from here
+            if xfer_poll():
+                power_touch()
+                return None
+    return None
+
+def read_battery():
+    adc = analogio.AnalogIn(board.IO10)
+    v = (adc.value * 3.3 / 65535) * 2
+    adc.deinit()
+    return v, max(0, min(100, (v - 3.2) / (4.2 - 3.2) * 100))
+
 def load_config():
     # CHANGED DEFAULT PASSWORD HERE
-    default_config = { "users": {"root": "pbash", "guest": ""}, "wifi": {} }
+    default_config = { "users": {"root": "pbash", "guest": ""}, "wifi": {},
+                       "power": {"dim": 30, "sleep": 120, "dim_level": 0.2, "poll": 0.2} }
     try:
         if file_exists("/config.json"):
             with open("/config.json", "r") as f:
                 conf = json.load(f)
                 if "users" not in conf: conf["users"] = default_config["users"]
                 if "wifi" not in conf: conf["wifi"] = {}
+                if "power" not in conf: conf["power"] = default_config["power"]
                 return conf
     except: pass
     return default_config
@@ -327,7 +569,7 @@ def cmd_ls(args):
         elif not arg.startswith("-"): path_arg = arg
     
     target = resolve_path(path_arg if path_arg else globals()['CWD'])
-    is_guest = globals()['CURRENT_USER'] == "guest"
+    is_root = globals()['CURRENT_USER'] == "root"
     
     try:
         items = os.listdir(target)
@@ -336,11 +578,11 @@ def cmd_ls(args):
         for item in sorted(items):
             if not show_all and item.startswith("."): continue
             
-            if is_guest:
+            if not is_root:
                 full_check = target + "/" + item if target != "/" else "/" + item
-                if full_check in PROTECTED_PATHS: continue
+                if not check_access(full_check, quiet=True): continue
             
-            if not is_guest and not show_all and target == "/" and "/" + item in PROTECTED_PATHS:
+            if is_root and not show_all and target == "/" and "/" + item in PROTECTED_PATHS:
                 continue
 
             full = target + "/" + item if target != "/" else "/" + item
@@ -355,7 +597,7 @@ def cmd_ls(args):
 
 def cmd_cd(args):
     """Change Directory"""
-    target = globals()['GUEST_HOME'] if globals()['CURRENT_USER'] == "guest" else globals()['ROOT_HOME']
+    target = user_home(globals()['CURRENT_USER'])
     if args: target = resolve_path(args[0])
     
     if not check_access(target): return
@@ -371,8 +613,7 @@ def cmd_cat(args):
     if not args: return
     p = resolve_path(args[0])
     if not check_access(p): return
-    try:
-        with open(p, "r") as f: term.print(f.read())
+    try: term.print(read_text(p))
     except: term.print("Read Error", 0xFF0000)
 
 def cmd_rm(args):
@@ -418,10 +659,108 @@ def cmd_cp(args):
     if not check_access(src): return
     if not check_access(dst, write_mode=True): return
     try:
-        with open(src, "r") as s, open(dst, "w") as d: d.write(s.read())
+        copy_file(src, dst, bytearray(COPY_BUF))
         term.print("Copied")
     except: term.print("Err", 0xFF0000)
 
+def cmd_gzip(args):
+    """gzip [-k] <file> - compress to <file>.gz, -k keeps the original"""
+    keep = "-k" in args
+    files = [a for a in args if not a.startswith("-")]
+    if not files: return term.print("Usage: gzip [-k] <file>")
+    src = resolve_path(files[0]); dst = src + ".gz"
+    if not check_access(src, write_mode=not keep) or not check_access(dst, write_mode=True): return
+    try:
+        size = os.stat(src)[6]
+        out = gz_compress(src, dst, bytearray(COPY_BUF))
+        if not keep: os.remove(src)
+        term.print(f"{size} -> {out} B ({100 * out / size if size else 100:.1f}%)", 0x00FF00)
+    except Exception as e:
+        try: os.remove(dst)
+        except OSError: pass
+        term.print(f"gzip: {e}", 0xFF0000)
+
+def cmd_gunzip(args):
+    """gunzip [-k] <file.gz> - decompress, -k keeps the archive"""
+    keep = "-k" in args
+    files = [a for a in args if not a.startswith("-")]
+    if not files or not files[0].endswith(".gz"): return term.print("Usage: gunzip [-k] <file.gz>")
+    src = resolve_path(files[0]); dst = src[:-3]
+    if not check_access(src, write_mode=not keep) or not check_access(dst, write_mode=True): return
+    try:
+        total = 0
+        with open(dst, "wb") as d:
+            for chunk in gz_chunks(src, bytearray(COPY_BUF)):
+                d.write(chunk); total += len(chunk)
+        if not keep: os.remove(src)
+        term.print(f"{dst} ({total} B)", 0x00FF00)
+    except Exception as e:
+        try: os.remove(dst)
+        except OSError: pass
+        term.print(f"gunzip: {e}", 0xFF0000)
+
+def sync_walk(root, skip, rel=""):
+    base = (root.rstrip("/") + rel) or "/"
+    for item in os.listdir(base):
+        r = rel + "/" + item
+        full = root.rstrip("/") + r
+        if full == skip or item == SYNC_INDEX: continue
+        if is_dir(full): yield from sync_walk(root, skip, r)
+        else: yield r
+
+def cmd_sync(args):
+    """sync [-d] [-n] <src> <dst> - copy new/changed files, -d deletes removed, -n dry run"""
+    delete = "-d" in args; dry = "-n" in args
+    paths = [a for a in args if not a.startswith("-")]
+    if len(paths) != 2: return term.print("Usage: sync [-d] [-n] <src> <dst>")
+    src, dst = resolve_path(paths[0]), resolve_path(paths[1])
+    if not is_dir(src): return term.print("src must be a dir", 0xFF0000)
+    if not check_access(src) or not check_access(dst, write_mode=True): return
+    index_path = dst.rstrip("/") + "/" + SYNC_INDEX
+    try:
+        with open(index_path, "r") as f: old = json.load(f)
+    except (OSError, ValueError): old = {}
+    new = {}; buf = bytearray(COPY_BUF)
+    copied = unchanged = removed = total = written = 0
+    start = time.monotonic()
+    try:
+        for rel in sync_walk(src, dst):
+            s_path, d_path = src.rstrip("/") + rel, dst.rstrip("/") + rel
+            if not check_access(s_path, quiet=True) or not check_access(d_path, write_mode=True, quiet=True):
+                # Not ours to touch: keep its index entry so -d doesn't see it as removed
+                if rel in old: new[rel] = old[rel]
+                continue
+            st = os.stat(s_path); size, mtime = st[6], st[8]
+            total += size
+            prev = old.get(rel)
+            if prev and prev[0] == size and file_exists(d_path):
+                # Same size: trust mtime, else fall back to the content hash
+                if prev[1] == mtime or prev[2] == file_crc(s_path, buf):
+                    new[rel] = [size, mtime, prev[2]]; unchanged += 1
+                    continue
+            if dry: term.print(f"+ {rel}"); copied += 1; written += size; continue
+            make_dirs(d_path[:d_path.rfind("/")])
+            n, crc = copy_file(s_path, d_path, buf)
+            new[rel] = [n, mtime, crc]; copied += 1; written += n
+        for rel in old:
+            if rel in new: continue
+            d_path = dst.rstrip("/") + rel
+            gone = not file_exists(src.rstrip("/") + rel)
+            if delete and gone and check_access(d_path, write_mode=True, quiet=True):
+                if dry: term.print(f"- {rel}")
+                else:
+                    try: os.remove(d_path)
+                    except OSError: pass
+                removed += 1
+            elif file_exists(d_path): new[rel] = old[rel]
+        if not dry:
+            with open(index_path, "w") as f: json.dump(new, f)
+    except Exception as e:
+        return klog(f"Sync Err: {e}", 0xFF0000)
+    term.print(f"{copied} copied, {unchanged} same, {removed} deleted", 0x00FF00)
+    pct = 100 * (total - written) / total if total else 100
+    term.print(f"{written} B written, {total - written} B saved ({pct:.0f}%) {time.monotonic() - start:.1f}s")
+
 def cmd_mv(args):
     if len(args) < 2: return
     src, dst = resolve_path(args[0]), resolve_path(args[1])
@@ -485,11 +824,26 @@ def cmd_nano(args):
 
 def cmd_shutdown(args):
     term.print("Shutting down...", 0xFFA500)
+    klog("Shutdown")
+    log_flush(force=True)
     time.sleep(1)
     # Go into deep sleep (Wake on Reset)
     alarm_obj = alarm.time.TimeAlarm(monotonic_time=time.monotonic() + 31536000)
     alarm.exit_and_deep_sleep_until_alarms(alarm_obj)
 
+def cmd_reboot(args):
+    klog("Reboot")
+    log_flush(force=True)
+    microcontroller.reset()
+
+def cmd_dmesg(args):
+    """dmesg [-c clear] [-f flush]"""
+    if "-f" in args: log_flush(force=True); return term.print("Flushed")
+    for line in log_lines(): term.print(line)
+    if "-c" in args:
+        log_flush(force=True)
+        LOG_STATE["ring"] = []; LOG_STATE["idx"] = 0; LOG_STATE["pending"] = 0
+
 def cmd_storage(args):
     if not args:
         term.print("Storage Manager:", 0x00FFFF)
@@ -523,20 +877,139 @@ def cmd_pbash(args):
     if args: run_script_file(args[0])
     else: term.print("Usage: pbash <file>")
 
+def resolve_host(pool, host):
+    return ipaddress.ip_address(pool.getaddrinfo(host, 80)[0][4][0])
+
+def ip_to_int(ip):
+    a, b, c, d = [int(x) for x in ip.split(".")]
+    return (a << 24) | (b << 16) | (c << 8) | d
+
+def int_to_ip(n):
+    return f"{n >> 24 & 255}.{n >> 16 & 255}.{n >> 8 & 255}.{n & 255}"
+
+def expand_targets(specs):
+    """'10.0.0.0/24', '10.0.0.5-20' or plain hosts -> list of host strings (max /24)."""
+    out = []
+    for spec in specs:
+        if "/" in spec:
+            base, bits = spec.split("/"); bits = int(bits)
+            if bits < 24 or bits > 32: raise ValueError("prefix must be /24-/32")
+            size = 1 << (32 - bits)
+            net = ip_to_int(base) & ~(size - 1)
+            first, last = (net + 1, net + size - 2) if size > 2 else (net, net + size - 1)
+            out.extend(int_to_ip(n) for n in range(first, last + 1))
+        elif "-" in spec and spec.count(".") == 3 and all(o.isdigit() and int(o) < 256 for o in spec.split(".")[:3]):
+            head, rng = spec.rsplit(".", 1)
+            lo, hi = [int(x) for x in rng.split("-")]
+            if not 0 <= lo <= hi <= 255: raise ValueError(f"range {rng}")
+            out.extend(f"{head}.{n}" for n in range(lo, hi + 1))
+        else: out.append(spec)
+    return out
+
+def ping_stats(times, sent):
+    """RTTs in seconds -> (min, avg, max, jitter) in ms plus loss %."""
+    loss = 100 * (sent - len(times)) / sent if sent else 0.0
+    if not times: return None, loss
+    ms = [t * 1000 for t in times]
+    jitter = sum(abs(ms[i] - ms[i-1]) for i in range(1, len(ms))) / (len(ms) - 1) if len(ms) > 1 else 0.0
+    return (min(ms), sum(ms) / len(ms), max(ms), jitter), loss
+
 def cmd_ping(args):
-    if not args: return term.print("Usage: ping <host>")
+    """ping [-c count] [-i interval] [-W timeout] <host>"""
+    count, interval, wait, host = 4, 0.5, 1.0, None
+    try:
+        i = 0
+        while i < len(args):
+            a = args[i]
+            if a in ("-c", "-i", "-W") and i + 1 < len(args):
+                v = args[i+1]; i += 1
+                if a == "-c": count = max(1, int(v))
+                elif a == "-i": interval = max(0.0, float(v))
+                else: wait = max(0.1, float(v))
+            else: host = a
+            i += 1
+    except ValueError: return term.print("Bad value", 0xFF0000)
+    if not host: return term.print("Usage: ping [-c N] [-i s] [-W s] <host>")
     if not wifi.radio.ipv4_address: return term.print("No WiFi connected.", 0xFF0000)
     try:
         pool = socketpool.SocketPool(wifi.radio)
-        ip = ipaddress.ip_address(pool.getaddrinfo(args[0], 80)[0][4][0])
+        ip = resolve_host(pool, host)
         term.print(f"Pinging {ip}...", 0x00FFFF)
-        for i in range(4):
-            t = wifi.radio.ping(ip)
-            if t: term.print(f"Reply: time={t*1000:.1f}ms", 0x00FF00)
+        times = []; sent = 0
+        for i in range(count):
+            if kb.check() == "ESCAPE": break
+            t = wifi.radio.ping(ip, timeout=wait); sent += 1
+            if t is not None:
+                times.append(t); term.print(f"Reply: time={t*1000:.1f}ms", 0x00FF00)
             else: term.print("Timeout", 0xFFA500)
-            time.sleep(0.5)
+            if i < count - 1: time.sleep(interval)
+        stats, loss = ping_stats(times, sent)
+        term.print(f"{sent} sent, {len(times)} recv, {loss:.0f}% loss", 0x00FFFF)
+        if stats: term.print("min/avg/max/jit {:.1f}/{:.1f}/{:.1f}/{:.1f}ms".format(*stats), 0x00FFFF)
     except: term.print("Ping Fail", 0xFF0000)
 
+def tcp_probe(sock, addr):
+    """Poll a non-blocking TCP connect: True if the host answered, False if it failed, None while pending."""
+    try:
+        sock.connect(addr)
+        return True
+    except OSError as e:
+        code = e.args[0] if e.args else 0
+        # A refused or reset connect still means the host is up
+        if code in (SWEEP_ISCONN, errno.ECONNREFUSED, errno.ECONNRESET): return True
+        if code in (errno.EINPROGRESS, errno.EALREADY, errno.ETIMEDOUT, errno.EAGAIN): return None
+        return False
+
+def cmd_sweep(args):
+    """sweep [-p parallel] [-P port] [-W timeout] <cidr|a.b.c.x-y|host>... (ESC stops)"""
+    par, port, wait, specs = SWEEP_PARALLEL, SWEEP_PORT, 0.5, []
+    try:
+        i = 0
+        while i < len(args):
+            a = args[i]
+            if a in ("-p", "-P", "-W") and i + 1 < len(args):
+                v = args[i+1]; i += 1
+                if a == "-p": par = max(1, int(v))
+                elif a == "-P": port = int(v)
+                else: wait = max(0.05, float(v))
+            else: specs.append(a)
+            i += 1
+        targets = expand_targets(specs)
+    except ValueError as e: return term.print(f"Bad target: {e}", 0xFF0000)
+    if not targets: return term.print("Usage: sweep [-p N] [-P port] [-W s] <10.0.0.0/24|10.0.0.1-50|host>...")
+    if not wifi.radio.ipv4_address: return term.print("No WiFi connected.", 0xFF0000)
+    pool = socketpool.SocketPool(wifi.radio)
+    term.print(f"Sweeping {len(targets)} hosts, tcp/{port} x{par}...", 0x00FFFF)
+    up = []; inflight = []; qi = 0; done = 0; start = time.monotonic()
+    while qi < len(targets) or inflight:
+        if kb.check() == "ESCAPE": break
+        # Top up the in-flight set; lwIP has few sockets, so a failed socket() just waits for a slot
+        while qi < len(targets) and len(inflight) < par:
+            host = targets[qi]
+            try: addr = (str(resolve_host(pool, host)), port)
+            except Exception:
+                qi += 1; done += 1; continue
+            try: sock = pool.socket(pool.AF_INET, pool.SOCK_STREAM)
+            except OSError:
+                if inflight: break
+                qi += 1; done += 1; continue
+            qi += 1
+            sock.settimeout(0)
+            inflight.append([host, sock, addr, time.monotonic()])
+        now = time.monotonic()
+        for p in inflight[:]:
+            host, sock, addr, t0 = p
+            state = tcp_probe(sock, addr)
+            if state is None and now - t0 < wait: continue
+            sock.close(); inflight.remove(p); done += 1
+            if state:
+                rtt = time.monotonic() - t0
+                up.append(rtt); term.print(f"{host:<15} {rtt*1000:.1f}ms", 0x00FF00)
+    for p in inflight: p[1].close()
+    stats, loss = ping_stats(up, done)
+    term.print(f"{len(up)}/{done} up in {time.monotonic() - start:.1f}s", 0x00FFFF)
+    if stats: term.print("min/avg/max {:.1f}/{:.1f}/{:.1f}ms".format(*stats[:3]), 0x00FFFF)
+
 def cmd_ntp(args):
     if not wifi.radio.ipv4_address: return term.print("No WiFi", 0xFF0000)
     offset = int(args[0]) if args else 0
@@ -594,11 +1067,30 @@ def cmd_python(args):
     term.print("Exited.")
 
 def cmd_battery(args):
-    adc = analogio.AnalogIn(board.IO10)
-    v = (adc.value * 3.3 / 65535) * 2
-    p = max(0, min(100, (v - 3.2) / (4.2 - 3.2) * 100))
+    v, p = read_battery()
     term.print(f"Bat: {p:.0f}% ({v:.2f}V)", 0x00FF00)
-    adc.deinit()
+
+def cmd_power(args):
+    """power [dim <s>|sleep <s>|level <0-1>|off]"""
+    conf = SYSTEM_CONFIG["power"]
+    if args:
+        sub = args[0]
+        try:
+            if sub == "off": conf["dim"] = 0; conf["sleep"] = 0
+            elif sub in ("dim", "sleep") and len(args) > 1: conf[sub] = int(args[1])
+            elif sub == "level" and len(args) > 1: conf["dim_level"] = max(0.0, min(1.0, float(args[1])))
+            else: return term.print("Usage: power [dim <s>|sleep <s>|level <0-1>|off]")
+        except ValueError: return term.print("Bad value", 0xFF0000)
+        save_config(SYSTEM_CONFIG)
+    v, p = read_battery()
+    left = BATTERY_MAH * p / 100
+    term.print(f"Mode: {POWER_STATE['mode']}  Bat: {p:.0f}% ({v:.2f}V)", 0x00FFFF)
+    dim = f"{conf['dim']}s @{conf.get('dim_level', 0.2)}" if conf.get('dim') else "off"
+    sleep = f"{conf['sleep']}s" if conf.get('sleep') else "off"
+    term.print(f"Dim: {dim}  Sleep: {sleep}")
+    for m in ("active", "dim", "sleep"):
+        ma = POWER_DRAW_MA[m]
+        term.print(f"  {m:<7}~{ma:>4}mA  {left / ma:5.1f}h", 0x00FF00 if m == POWER_STATE["mode"] else 0xFFFFFF)
 
 def cmd_su(args):
     target = args[0] if args else "root"
@@ -614,7 +1106,8 @@ def cmd_su(args):
         time.sleep(0.01)
     if p==SYSTEM_CONFIG["users"][target]:
         globals()['CURRENT_USER']=target
-        h = f"/home/{target}" if target not in ["root", "guest"] else (globals()['ROOT_HOME'] if target=="root" else globals()['GUEST_HOME'])
+        compile_acl(target)
+        h = user_home(target)
         try: os.stat(h); globals()['CWD'] = h
         except: pass
         term.print("OK", 0x00FF00)
@@ -643,12 +1136,87 @@ def cmd_passwd(args):
     save_config(SYSTEM_CONFIG); term.print("Saved")
 
 def cmd_logout(args):
-    globals()['CURRENT_USER']="guest"; update_prompt()
+    globals()['CURRENT_USER']="guest"; compile_acl("guest"); update_prompt()
+
+def cmd_acl(args):
+    """acl [user] | acl <user> <path> <rw|r|-|del>"""
+    user = args[0] if args else globals()['CURRENT_USER']
+    if len(args) >= 3:
+        if globals()['CURRENT_USER'] != "root": return term.print("Root only", 0xFF0000)
+        path, perm = args[1], args[2]
+        if perm not in ("rw", "r", "-", "del"): return term.print("Perm: rw r - del", 0xFF0000)
+        if not path.startswith("~"): path = resolve_path(path)
+        rules = SYSTEM_CONFIG.setdefault("acl", {}).setdefault(user, [])
+        rules[:] = [r for r in rules if r[0] != path]
+        if perm != "del": rules.append([path, perm])
+        save_config(SYSTEM_CONFIG)
+        compile_acl(globals()['CURRENT_USER'])
+    if user == "root": return term.print("root: unrestricted", 0x00FFFF)
+    for path, perm in acl_rules(user): term.print(f"{perm:<3}{path}")
 
 def cmd_scan(args):
     for n in wifi.radio.start_scanning_networks(): term.print(f"{n.ssid} {n.rssi}")
     wifi.radio.stop_scanning_networks()
 
+def wifi_remember(ssid):
+    """Cache BSSID/channel of the current AP so the next connect can skip the scan."""
+    try:
+        ap = wifi.radio.ap_info
+        last = {"ssid": ssid, "bssid": str(binascii.hexlify(ap.bssid), "ascii"), "channel": ap.channel}
+    except: return
+    if SYSTEM_CONFIG.get("wifi_last") != last:
+        SYSTEM_CONFIG["wifi_last"] = last; save_config(SYSTEM_CONFIG)
+
+def wifi_auto_connect():
+    """Cached BSSID/channel first, then the strongest known network from a scan."""
+    known = SYSTEM_CONFIG["wifi"]
+    last = SYSTEM_CONFIG.get("wifi_last")
+    if last and last.get("ssid") in known:
+        try:
+            wifi.radio.connect(last["ssid"], known[last["ssid"]], channel=last["channel"],
+                               bssid=binascii.unhexlify(last["bssid"]), timeout=WIFI_FAST_TIMEOUT)
+            return last["ssid"]
+        except: pass
+    best = None
+    try:
+        for n in wifi.radio.start_scanning_networks():
+            if n.ssid in known and (best is None or n.rssi > best.rssi): best = n
+    except Exception as e:
+        # Radio off or already scanning: let wifi_tick back off and retry
+        klog(f"[WIFI] Scan failed: {e}")
+        return None
+    finally:
+        try: wifi.radio.stop_scanning_networks()
+        except Exception: pass
+    if not best: return None
+    try: wifi.radio.connect(best.ssid, known[best.ssid], channel=best.channel, bssid=best.bssid, timeout=WIFI_SCAN_TIMEOUT)
+    except: return None
+    wifi_remember(best.ssid)
+    return best.ssid
+
+def wifi_tick():
+    """Shell-loop hook: keeps a known network up, retrying with exponential backoff
+    once the user has been idle for WIFI_IDLE_SECS."""
+    now = time.monotonic()
+    if now < WIFI_STATE["next"]: return
+    if wifi.radio.ipv4_address:
+        WIFI_STATE["up"] = True; WIFI_STATE["backoff"] = 2; WIFI_STATE["next"] = now + 1
+        return
+    if WIFI_STATE["up"]:
+        WIFI_STATE["up"] = False
+        klog("[WIFI] Link lost", 0xFFA500)
+    if not SYSTEM_CONFIG["wifi"]:
+        WIFI_STATE["next"] = now + 5; return
+    # Connect and scan block the shell, so never start one while the user is typing
+    if now - POWER_STATE["last"] < WIFI_IDLE_SECS: return
+    ssid = wifi_auto_connect()
+    if ssid:
+        WIFI_STATE["up"] = True; WIFI_STATE["backoff"] = 2; WIFI_STATE["next"] = time.monotonic() + 1
+        klog(f"[WIFI] {ssid} {wifi.radio.ipv4_address}", 0x00FF00)
+    else:
+        WIFI_STATE["next"] = time.monotonic() + WIFI_STATE["backoff"]
+        WIFI_STATE["backoff"] = min(WIFI_STATE["backoff"] * 2, WIFI_BACKOFF_MAX)
+
 def cmd_connect(args):
     if not args: return
     p = args[1] if len(args)>1 else SYSTEM_CONFIG["wifi"].get(args[0])
@@ -656,23 +1224,452 @@ def cmd_connect(args):
         try: 
             wifi.radio.connect(args[0], p); term.print("Connected", 0x00FF00)
             SYSTEM_CONFIG["wifi"][args[0]]=p; save_config(SYSTEM_CONFIG)
+            wifi_remember(args[0])
         except: term.print("Fail", 0xFF0000)
     else: term.print("Pass required", 0xFF0000)
 
 def cmd_wget(args):
+    """wget <url> <file> - asks for gzip; compressed replies are kept as <file>.gz"""
     if len(args)<2: return
+    dst = resolve_path(args[1])
+    if not check_access(dst, write_mode=True): return
     try:
+        parts = args[0].split("/")
+        host, port = parts[2], 80
+        if ":" in host: host, port = host.split(":")[0], int(host.split(":")[1])
         pool = socketpool.SocketPool(wifi.radio)
         r = pool.socket(pool.AF_INET, pool.SOCK_STREAM)
-        r.connect(pool.getaddrinfo(args[0].split("/")[2], 80)[0][-1])
-        r.send(f"GET /{''.join(args[0].split('/')[3:])} HTTP/1.0\r\n\r\n".encode())
-        with open(resolve_path(args[1]), "w") as f:
+        r.settimeout(10)
+        r.connect(pool.getaddrinfo(host, port)[0][-1])
+        sock_send_all(r, f"GET /{'/'.join(parts[3:])} HTTP/1.0\r\nHost: {host}\r\nAccept-Encoding: gzip\r\n\r\n".encode())
+        buf = bytearray(COPY_BUF); mv = memoryview(buf); n = 0
+        status = None; gz = False; skipping = False; in_head = True
+        # Parse header lines as they arrive and drop them, so header size is unbounded
+        while in_head:
+            if n == len(buf):
+                # A single line longer than the buffer (CSP, cookies): discard it
+                if status is None: raise OSError("bad status line")
+                mv[0] = buf[n-1]; n = 1; skipping = True
+            got = r.recv_into(mv[n:])
+            if not got: raise OSError("no reply")
+            n += got
             while True:
-                d = r.recv(128)
-                if not d: break
-                f.write(str(d, 'utf-8'))
-        term.print("Done")
-    except: term.print("Fail", 0xFF0000)
+                i = bytes(buf[:n]).find(b"\r\n")
+                if i < 0: break
+                line = bytes(buf[:i]).lower()
+                mv[:n - i - 2] = buf[i+2:n]; n -= i + 2
+                if skipping: skipping = False
+                elif status is None: status = str(line, "utf-8")
+                elif not line: in_head = False; break
+                elif line.startswith(b"content-encoding:") and b"gzip" in line: gz = True
+        if " 200" not in status: raise OSError(status)
+        if gz and not dst.endswith(".gz"): dst += ".gz"
+        total = n
+        with open(dst, "wb") as f:
+            f.write(mv[:n])
+            while True:
+                got = r.recv_into(buf)
+                if not got: break
+                f.write(mv[:got]); total += got
+        r.close()
+        term.print(f"Done: {dst} ({total} B)")
+    except Exception as e: term.print(f"Fail: {e}", 0xFF0000)
+
+# --- HTTP FILE SERVER ---
+def url_unquote(s):
+    out = bytearray(); b = s.encode(); i = 0
+    while i < len(b):
+        if b[i] == 37 and i + 2 < len(b):  # '%'
+            try: out.append(int(b[i+1:i+3], 16)); i += 3; continue
+            except ValueError: pass
+        out.append(b[i]); i += 1
+    return str(bytes(out), "utf-8")
+
+def sock_send_all(sock, data):
+    mv = memoryview(data); sent = 0
+    while sent < len(mv): sent += sock.send(mv[sent:])
+
+def http_reply(conn, code, reason, body=b"", length=None, ctype="text/plain"):
+    if isinstance(body, str): body = body.encode()
+    if length is None: length = len(body)
+    sock_send_all(conn, f"HTTP/1.1 {code} {reason}\r\nContent-Type: {ctype}\r\nContent-Length: {length}\r\nConnection: close\r\n\r\n".encode())
+    if body: sock_send_all(conn, body)
+    return code
+
+def http_authorized(headers, password):
+    if not password: return True
+    auth = headers.get("authorization", "")
+    if not auth.startswith("Basic "): return False
+    try: cred = str(binascii.a2b_base64(auth[6:]), "utf-8")
+    except: return False
+    return cred[cred.find(":")+1:] == password
+
+def serve_request(conn, buf, password):
+    """Handle one request. GET lists dirs or streams files, PUT streams the body to disk."""
+    mv = memoryview(buf); n = 0
+    while True:
+        if n >= len(buf): return http_reply(conn, 431, "Header Too Large")
+        got = conn.recv_into(mv[n:])
+        if not got: return None
+        n += got
+        end = bytes(buf[:n]).find(b"\r\n\r\n")
+        if end >= 0: break
+    lines = str(bytes(buf[:end]), "utf-8").split("\r\n")
+    req = lines[0].split(" ")
+    if len(req) < 2: return http_reply(conn, 400, "Bad Request")
+    method = req[0]
+    path = resolve_path(url_unquote(req[1].split("?")[0]))
+    headers = {}
+    for h in lines[1:]:
+        i = h.find(":")
+        if i > 0: headers[h[:i].strip().lower()] = h[i+1:].strip()
+    if not http_authorized(headers, password):
+        sock_send_all(conn, b"HTTP/1.1 401 Unauthorized\r\nWWW-Authenticate: Basic realm=\"pbash\"\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+        return 401
+
+    if method == "GET":
+        if not check_access(path): return http_reply(conn, 403, "Forbidden")
+        if is_dir(path):
+            out = []
+            for item in sorted(os.listdir(path)):
+                full = path + "/" + item if path != "/" else "/" + item
+                if not check_access(full, quiet=True): continue
+                out.append(item + "/" if is_dir(full) else item)
+            return http_reply(conn, 200, "OK", "\n".join(out) + "\n")
+        try: size = os.stat(path)[6]
+        except OSError: return http_reply(conn, 404, "Not Found")
+        http_reply(conn, 200, "OK", length=size, ctype="application/octet-stream")
+        with open(path, "rb") as f:
+            while True:
+                got = f.readinto(buf)
+                if not got: break
+                sock_send_all(conn, mv[:got])
+        return 200
+
+    if method == "PUT":
+        if not check_access(path, write_mode=True): return http_reply(conn, 403, "Forbidden")
+        if "content-length" not in headers: return http_reply(conn, 411, "Length Required")
+        try: remaining = int(headers["content-length"])
+        except ValueError: return http_reply(conn, 400, "Bad Request")
+        if remaining < 0: return http_reply(conn, 400, "Bad Request")
+        if headers.get("expect", "").lower() == "100-continue":
+            sock_send_all(conn, b"HTTP/1.1 100 Continue\r\n\r\n")
+        # Body bytes already read with the header go to the front of the buffer
+        fill = n - (end + 4)
+        mv[:fill] = buf[end+4:n]
+        remaining -= fill
+        tmp = path + ".part"
+        try:
+            with open(tmp, "wb") as f:
+                while True:
+                    # Only touch flash once the buffer is full (or the body ends)
+                    while remaining > 0 and fill < len(buf):
+                        got = conn.recv_into(mv[fill:], min(len(buf) - fill, remaining))
+                        if not got: raise OSError("short body")
+                        fill += got; remaining -= got
+                    if fill: f.write(mv[:fill]); fill = 0
+                    if remaining <= 0: break
+            if file_exists(path): os.remove(path)
+            os.rename(tmp, path)
+        except OSError as e:
+            try: os.remove(tmp)
+            except OSError: pass
+            return http_reply(conn, 500, "Error", str(e))
+        return http_reply(conn, 201, "Created")
+
+    return http_reply(conn, 405, "Method Not Allowed")
+
+def cmd_serve(args):
+    """serve [port] - WiFi file server. ESC stops."""
+    try:
+        port = int(args[0]) if args else SERVE_PORT
+        if not 0 < port < 65536: raise ValueError
+    except ValueError: return term.print("Bad value", 0xFF0000)
+    if not wifi.radio.ipv4_address: return term.print("No WiFi", 0xFF0000)
+    password = os.getenv("CIRCUITPY_WEB_API_PASSWORD")
+    pool = socketpool.SocketPool(wifi.radio)
+    srv = pool.socket(pool.AF_INET, pool.SOCK_STREAM)
+    try:
+        srv.setsockopt(pool.SOL_SOCKET, pool.SO_REUSEADDR, 1)
+        srv.bind((str(wifi.radio.ipv4_address), port))
+        srv.listen(2)
+        srv.setblocking(False)
+    except Exception as e:
+        srv.close()
+        return term.print(f"Serve Err: {e}", 0xFF0000)
+    buf = bytearray(SERVE_BUF)
+    term.print(f"http://{wifi.radio.ipv4_address}:{port}/ (ESC stops)", 0x00FF00)
+    try:
+        while kb.check() != "ESCAPE":
+            try: conn, addr = srv.accept()
+            except OSError:
+                time.sleep(0.01); continue
+            try:
+                conn.settimeout(5)
+                code = serve_request(conn, buf, password)
+                if code: term.print(f"{addr[0]} {code}", 0x555555)
+            except Exception as e: term.print(f"Serve Err: {e}", 0xFF0000)
+            finally: conn.close()
+    finally: srv.close()
+    term.print("Server stopped.")
+
+# --- USB BULK TRANSFER ---
+# Host side lives in tools/pbxfer.py. Kinds: P put, G get, L list, T stat,
+# D data, A ack (cumulative), N nak (resend from seq), S size, R reply, E error, X abort.
+def xfer_send(kind, seq, payload=b""):
+    hdr = struct.pack("<BBBIH", 0xA5, 0x5A, kind, seq, len(payload))
+    crc = binascii.crc32(payload, binascii.crc32(memoryview(hdr)[2:]))
+    port = usb_cdc.data
+    for part in (hdr, payload, struct.pack("<I", crc)):
+        if part and (port.write(part) or 0) < len(part): raise OSError("short write")
+
+def xfer_end(msg=None, ok=True):
+    st = XFER_STATE
+    f = st.get("file")
+    if f:
+        f.close()
+        if st["mode"] == "recv" and not ok:
+            try: os.remove(st["path"] + ".part")
+            except OSError: pass
+    st["mode"] = None; st["file"] = None; st["blob"] = None; st["wbuf"] = None
+    if msg: klog(f"[XFER] {msg}")
+
+def xfer_flush_wbuf():
+    st = XFER_STATE
+    if st["fill"]:
+        st["file"].write(memoryview(st["wbuf"])[:st["fill"]]); st["fill"] = 0
+
+def xfer_start_send(size, file=None, blob=None):
+    st = XFER_STATE
+    st.update(mode="send", file=file, blob=blob, size=size, base=1, next=1,
+              last=(size + XFER_CHUNK - 1) // XFER_CHUNK, retries=0,
+              cbuf=st.get("cbuf") or bytearray(XFER_CHUNK))
+    xfer_send(0x53, 0, struct.pack("<I", size))
+    if not st["last"]: xfer_end()
+
+def xfer_handle(kind, seq, payload):
+    st = XFER_STATE
+    mode = st["mode"]
+    if kind == 0x44 and mode == "recv":  # D
+        if seq != st["expect"]:
+            if seq < st["expect"]: xfer_send(0x41, st["expect"] - 1)
+            else: xfer_send(0x4E, st["expect"])
+            return
+        n = len(payload)
+        if st["fill"] + n > len(st["wbuf"]): xfer_flush_wbuf()
+        st["wbuf"][st["fill"]:st["fill"] + n] = payload
+        st["fill"] += n; st["remaining"] -= n; st["expect"] += 1
+        if st["remaining"] <= 0:
+            xfer_flush_wbuf(); st["file"].close(); st["file"] = None
+            path = st["path"]
+            if file_exists(path): os.remove(path)
+            os.rename(path + ".part", path)
+            xfer_end(f"put {path} {st['size']} B")
+        xfer_send(0x41, seq)
+    elif kind == 0x41 and mode == "send":  # A
+        if seq >= st["base"]: st["base"] = seq + 1; st["retries"] = 0
+        if st["base"] > st["last"]: xfer_end()
+    elif kind == 0x4E and mode == "send":  # N
+        st["next"] = max(seq, st["base"])
+    elif kind == 0x58:  # X
+        if mode: xfer_end("aborted", ok=False)
+    elif kind in (0x50, 0x47, 0x4C, 0x54):  # P G L T
+        if mode: xfer_end("superseded", ok=False)
+        if kind == 0x50:
+            size = struct.unpack_from("<I", payload, 0)[0]
+            path = resolve_path(str(bytes(payload[4:]), "utf-8"))
+        else: path = resolve_path(str(bytes(payload), "utf-8"))
+        if not check_access(path, write_mode=kind == 0x50, quiet=True): return xfer_send(0x45, 0, b"denied")
+        try:
+            if kind == 0x50:
+                st.update(mode="recv", path=path, size=size, remaining=size, expect=1, fill=0,
+                          file=open(path + ".part", "wb"), wbuf=st.get("wbuf") or bytearray(XFER_BUF))
+                if size: xfer_send(0x41, 0)
+                else: xfer_handle(0x44, 1, b"")
+            elif kind == 0x47:
+                xfer_start_send(os.stat(path)[6], file=open(path, "rb"))
+            elif kind == 0x4C:
+                names = [i + "/" if is_dir(path.rstrip("/") + "/" + i) else i for i in sorted(os.listdir(path))]
+                blob = "\n".join(names).encode()
+                xfer_start_send(len(blob), blob=blob)
+            else:
+                xfer_send(0x52, 0, struct.pack("<BI", is_dir(path), os.stat(path)[6]))
+        except OSError as e:
+            if st["mode"]: xfer_end(ok=False)
+            xfer_send(0x45, 0, str(e).encode())
+
+def xfer_pump():
+    """Keep up to XFER_WINDOW unacked DATA frames in flight; go back to base on timeout."""
+    st = XFER_STATE
+    now = time.monotonic()
+    if now - st["t"] > XFER_TIMEOUT:
+        st["retries"] += 1; st["next"] = st["base"]; st["t"] = now
+        if st["retries"] > XFER_RETRIES: return xfer_end("send timeout", ok=False)
+    while st["next"] <= st["last"] and st["next"] < st["base"] + XFER_WINDOW:
+        k = st["next"]; off = (k - 1) * XFER_CHUNK
+        if st["blob"] is not None: chunk = st["blob"][off:off + XFER_CHUNK]
+        else:
+            st["file"].seek(off)
+            chunk = memoryview(st["cbuf"])[:st["file"].readinto(st["cbuf"])]
+        xfer_send(0x44, k, chunk)
+        st["next"] = k + 1
+
+def xfer_poll():
+    """Service the usb_cdc data port from the shell loop; True while a transfer runs."""
+    port = usb_cdc.data
+    if port is None: return False
+    st = XFER_STATE
+    if st["rx"] is None:
+        port.timeout = 0
+        port.write_timeout = XFER_WRITE_TIMEOUT
+        st["rx"] = bytearray(2 * (XFER_CHUNK + 13))
+    rx = st["rx"]; mv = memoryview(rx)
+    waiting = port.in_waiting
+    if waiting:
+        st["n"] += port.readinto(mv[st["n"]:st["n"] + min(waiting, len(rx) - st["n"])]) or 0
+        n = st["n"]; i = 0
+        while True:
+            while i + 1 < n and not (rx[i] == 0xA5 and rx[i+1] == 0x5A): i += 1
+            if n - i < 13: break
+            kind, seq, ln = struct.unpack_from("<BIH", rx, i + 2)
+            if ln > XFER_CHUNK: i += 1; continue
+            if n - i < 13 + ln: break
+            if binascii.crc32(mv[i+2:i+9+ln]) == struct.unpack_from("<I", rx, i + 9 + ln)[0]:
+                st["t"] = time.monotonic()
+                try: xfer_handle(kind, seq, mv[i+9:i+9+ln])
+                except Exception as e: xfer_end(f"Err: {e}", ok=False)
+                i += 13 + ln
+            else:
+                if st["mode"] == "recv":
+                    try: xfer_send(0x4E, st["expect"])
+                    except Exception as e: xfer_end(f"Err: {e}", ok=False)
+                i += 1
+        mv[:n - i] = rx[i:n]
+        st["n"] = n - i
+    if st["mode"] == "send":
+        try: xfer_pump()
+        except Exception as e:
+            xfer_end(f"Err: {e}", ok=False)
+            try: xfer_send(0x45, 0, str(e).encode()[:XFER_CHUNK])
+            except Exception: pass
+    elif st["mode"] == "recv" and time.monotonic() - st["t"] > XFER_TIMEOUT * XFER_RETRIES:
+        xfer_end("recv timeout", ok=False)
+    if st["mode"]: POWER_STATE["last"] = time.monotonic()
+    return st["mode"] is not None
+
+def cmd_xfer(args):
+    if usb_cdc.data is None: return term.print("USB data port off (see boot.py)", 0xFF0000)
+    st = XFER_STATE
+    if st["mode"] == "recv": term.print(f"Receiving {st['path']} {st['size'] - st['remaining']}/{st['size']} B", 0x00FFFF)
+    elif st["mode"] == "send": term.print(f"Sending {min(st['base'] - 1, st['last'])}/{st['last']} chunks", 0x00FFFF)
+    else: term.print("USB transfer idle", 0x00FF00)
+
+# --- CRON ---
+# Jobs sit in a binary min-heap of (deadline, job id), so a tick only looks at the top.
+def heap_push(h, item):
+    h.append(item); i = len(h) - 1
+    while i:
+        p = (i - 1) // 2
+        if h[p] <= h[i]: break
+        h[p], h[i] = h[i], h[p]; i = p
+
+def heap_pop(h):
+    top = h[0]; last = h.pop()
+    if h:
+        h[0] = last; i = 0; n = len(h)
+        while True:
+            c = 2 * i + 1
+            if c >= n: break
+            if c + 1 < n and h[c+1] < h[c]: c += 1
+            if h[i] <= h[c]: break
+            h[i], h[c] = h[c], h[i]; i = c
+    return top
+
+def parse_interval(text):
+    """'90', '30s', '5m', '2h', '1d' -> seconds"""
+    mult = {"s": 1, "m": 60, "h": 3600, "d": 86400}.get(text[-1:], 0)
+    secs = float(text[:-1]) * mult if mult else float(text)
+    if secs < 1: raise ValueError("interval < 1s")
+    return secs
+
+def cron_load():
+    """Parse the crontab ('<interval> [@user] <command...>' per line) and schedule every job."""
+    CRON["jobs"] = []; CRON["heap"] = []
+    if not file_exists(CRONTAB): return 0
+    now = time.monotonic()
+    try:
+        with open(CRONTAB, "r") as f: lines = f.readlines()
+    except OSError as e:
+        klog(f"[CRON] {e}", 0xFF0000); return 0
+    for n, line in enumerate(lines):
+        line = line.strip()
+        if not line or line.startswith("#"): continue
+        parts = line.split(" ", 1)
+        try: every = parse_interval(parts[0])
+        except ValueError:
+            klog(f"[CRON] line {n+1}: bad interval", 0xFF0000); continue
+        cmd = parts[1].strip() if len(parts) > 1 else ""
+        owner = "root"
+        if cmd.startswith("@"):
+            owner, _, cmd = cmd[1:].partition(" "); cmd = cmd.strip()
+        if owner not in SYSTEM_CONFIG["users"]:
+            klog(f"[CRON] line {n+1}: no user {owner}", 0xFF0000); continue
+        if not cmd: continue
+        CRON["jobs"].append({"every": every, "cmd": cmd, "owner": owner, "runs": 0, "last": 0.0, "max": 0.0, "total": 0.0})
+        heap_push(CRON["heap"], (now + every, len(CRON["jobs"]) - 1))
+    return len(CRON["jobs"])
+
+def cron_run(i):
+    """Run job i as its owner, then restore the logged-in user, ACL and cwd."""
+    job = CRON["jobs"][i]
+    user, cwd = globals()['CURRENT_USER'], globals()['CWD']
+    globals()['CURRENT_USER'] = job["owner"]; compile_acl(job["owner"])
+    start = time.monotonic()
+    try:
+        if is_dir(user_home(job["owner"])): globals()['CWD'] = user_home(job["owner"])
+        run_command_line(job["cmd"])
+    except Exception as e: klog(f"[CRON] {job['cmd']}: {e}", 0xFF0000)
+    finally:
+        globals()['CURRENT_USER'] = user; compile_acl(user); globals()['CWD'] = cwd
+    dur = time.monotonic() - start
+    job["runs"] += 1; job["last"] = dur; job["total"] += dur
+    if dur > job["max"]: job["max"] = dur
+    klog(f"[CRON] {job['owner']}: {job['cmd']} {dur:.2f}s")
+
+def cron_tick():
+    """Run due jobs. Next deadline stays on the original grid; missed slots are skipped."""
+    h = CRON["heap"]
+    while h and h[0][0] <= time.monotonic():
+        due, i = heap_pop(h)
+        cron_run(i)
+        every = CRON["jobs"][i]["every"]
+        heap_push(h, (due + (int((time.monotonic() - due) // every) + 1) * every, i))
+
+def cmd_cron(args):
+    """cron [reload | run <id> | add <interval> [@user] <cmd...>]"""
+    sub = args[0] if args else ""
+    if sub in ("run", "add") and globals()['CURRENT_USER'] != "root": return term.print("Root only", 0xFF0000)
+    if sub == "reload": return term.print(f"{cron_load()} jobs", 0x00FF00)
+    if sub == "run" and len(args) > 1:
+        try: i = int(args[1])
+        except ValueError: i = -1
+        if not 0 <= i < len(CRON["jobs"]): return term.print("No such job", 0xFF0000)
+        return cron_run(i)
+    if sub == "add" and len(args) > 2:
+        try: parse_interval(args[1])
+        except ValueError: return term.print("Bad interval", 0xFF0000)
+        try:
+            with open(CRONTAB, "a") as f: f.write(" ".join(args[1:]) + "\n")
+        except OSError as e: return term.print(f"Err: {e}", 0xFF0000)
+        return term.print(f"{cron_load()} jobs", 0x00FF00)
+    if sub: return term.print("Usage: cron [reload|run <id>|add <interval> [@user] <cmd>]")
+    if not CRON["jobs"]: return term.print(f"No jobs ({CRONTAB})", 0x555555)
+    nxt = {i: due for due, i in CRON["heap"]}
+    now = time.monotonic()
+    for i, job in enumerate(CRON["jobs"]):
+        avg = job["total"] / job["runs"] if job["runs"] else 0.0
+        term.print(f"{i} every {job['every']:.0f}s in {nxt.get(i, now) - now:.0f}s @{job['owner']}: {job['cmd']}", 0x00FFFF)
+        term.print(f"  runs {job['runs']} last {job['last']:.2f}s avg {avg:.2f}s max {job['max']:.2f}s")
 
 # --- COMMAND REGISTRY ---
 COMMANDS = {
@@ -684,17 +1681,24 @@ COMMANDS = {
     "rm": cmd_rm,
     "mkdir": cmd_mkdir,
     "cp": cmd_cp,
+    "sync": cmd_sync,
+    "gzip": cmd_gzip,
+    "gunzip": cmd_gunzip,
     "mv": cmd_mv,
     "touch": cmd_touch,
     "su": cmd_su,
     "login": cmd_su,
     "logout": cmd_logout,
+    "acl": cmd_acl,
     "whoami": lambda x: term.print(globals()['CURRENT_USER']),
     "scan": cmd_scan,
     "connect": cmd_connect,
     "wget": cmd_wget,
+    "serve": cmd_serve,
+    "xfer": cmd_xfer,
     "battery": cmd_battery,
     "bat": cmd_battery,
+    "power": cmd_power,
     "python": cmd_python,
     "disk": cmd_disk,
     "df": cmd_disk,
@@ -706,13 +1710,16 @@ COMMANDS = {
     "sleep": cmd_sleep,
     "pbash": cmd_pbash,
     "ping": cmd_ping,
+    "sweep": cmd_sweep,
     "passwd": cmd_passwd,
     "adduser": cmd_adduser,
     "storage": cmd_storage,
     "shutdown": cmd_shutdown,
+    "dmesg": cmd_dmesg,
+    "cron": cmd_cron,
     "ifconfig": lambda x: term.print(f"IP: {wifi.radio.ipv4_address}"),
     "clear": lambda x: term.clear(),
-    "reboot": lambda x: microcontroller.reset(),
+    "reboot": cmd_reboot,
     "free": lambda x: term.print(f"RAM: {gc.mem_free()}")
 }
 
@@ -751,12 +1758,15 @@ def main_os():
     globals()['SYSTEM_PATH'] = SYSTEM_PATH
 
     # Init Subsystems
+    t = time.localtime()
+    klog("pbashOS boot {}/{}/{} {:02}:{:02}".format(t.tm_mon, t.tm_mday, t.tm_year, t.tm_hour, t.tm_min))
     mount_sd_card()
     SYSTEM_CONFIG = load_config()
     
     # Defaults
     if "root" not in SYSTEM_CONFIG["users"]: SYSTEM_CONFIG["users"]["root"] = "pbash"
     if "guest" not in SYSTEM_CONFIG["users"]: SYSTEM_CONFIG["users"]["guest"] = ""
+    compile_acl(CURRENT_USER)
 
     # Create Dirs
     try:
@@ -764,7 +1774,7 @@ def main_os():
         for d in ["/home", GUEST_HOME, ROOT_HOME]:
             try: os.mkdir(d)
             except: pass
-    except: term.print("[INIT] Drive Err", 0x555555)
+    except: klog("[INIT] Drive Err", 0x555555)
 
     try: os.stat(GUEST_HOME); globals()['CWD'] = GUEST_HOME
     except: globals()['CWD'] = "/"
@@ -772,14 +1782,24 @@ def main_os():
     # Boot Scripts
     if file_exists("/boot.pbash"): run_script_file("/boot.pbash")
     elif file_exists("/sd/boot.pbash"): run_script_file("/sd/boot.pbash")
+    if cron_load(): klog(f"[INIT] cron: {len(CRON['jobs'])} jobs", 0x555555)
 
     update_prompt()
 
     globals()['current_input'] = ""
     cursor_pos = 0
+    power_touch()
 
     while True:
         char = kb.check()
+        busy = xfer_poll()
+        if not char and not busy:
+            wifi_tick()
+            cron_tick()
+            log_flush()
+            char = power_idle()
+        # A key that wakes a dark screen only wakes it
+        if char and power_touch() == "sleep": char = None
         if char:
             if char == "ENTER":
                 term.print(f"{globals()['PROMPT_CHAR']} {globals()['current_input']}", 0x555555)
@@ -788,7 +1808,8 @@ def main_os():
                     HIST_IDX = len(SHELL_HISTORY)
 
                 run_command_line(globals()['current_input'])
-                
+                # Idle time counts from when the command finished, not when it began
+                power_touch()
                 globals()['current_input'] = ""
                 cursor_pos = 0
                 term.label_input.text = "_"
@@ -832,7 +1853,7 @@ def main_os():
             else:
                 term.label_input.text = vis_str
             
-        time.sleep(0.005)
+        if not busy: time.sleep(0.005)
 
 globals()['current_input'] = ""
 try:
@@ -0,0 +1,170 @@
+"""pbxfer - host side of the pbashOS USB CDC transfer protocol.
+
+    python pbxfer.py PORT put <local> <remote>
+    python pbxfer.py PORT get <remote> <local>
+    python pbxfer.py PORT ls [remote]
+    python pbxfer.py PORT stat <remote>
+
+PORT is the pbashOS *data* serial port (the second CDC interface, enabled in
+boot.py). Needs pyserial. Any serial-like path works, including a pty.
+"""
+import binascii
+import os
+import struct
+import sys
+import time
+
+CHUNK = 512
+WINDOW = 8
+TIMEOUT = 1.0
+RETRIES = 5
+
+
+def frame(kind, seq, payload=b""):
+    hdr = struct.pack("<BBBIH", 0xA5, 0x5A, ord(kind), seq, len(payload))
+    return hdr + payload + struct.pack("<I", binascii.crc32(hdr[2:] + payload))
+
+
+class Link:
+    def __init__(self, port):
+        import serial
+        self.ser = serial.Serial(port, 115200, timeout=0.05)
+        self.ser.reset_input_buffer()
+        self.rx = bytearray()
+
+    def send(self, kind, seq, payload=b""):
+        self.ser.write(frame(kind, seq, payload))
+
+    def recv(self, timeout=TIMEOUT):
+        """Next valid frame as (kind, seq, payload), or None on timeout."""
+        end = time.monotonic() + timeout
+        while True:
+            rx = self.rx
+            i = rx.find(b"\xa5\x5a")
+            if i < 0:
+                del rx[:max(0, len(rx) - 1)]
+            else:
+                del rx[:i]
+                if len(rx) >= 13:
+                    kind, seq, ln = struct.unpack_from("<BIH", rx, 2)
+                    if ln > CHUNK:
+                        del rx[:1]
+                        continue
+                    if len(rx) >= 13 + ln:
+                        body = bytes(rx[2:9 + ln])
+                        crc = struct.unpack_from("<I", rx, 9 + ln)[0]
+                        if binascii.crc32(body) == crc:
+                            del rx[:13 + ln]
+                            return chr(kind), seq, body[7:]
+                        del rx[:1]
+                        continue
+            if time.monotonic() > end:
+                return None
+            rx.extend(self.ser.read(self.ser.in_waiting or 1))
+
+    def expect(self, kinds, timeout=TIMEOUT * RETRIES):
+        end = time.monotonic() + timeout
+        while time.monotonic() < end:
+            f = self.recv()
+            if f is None:
+                continue
+            if f[0] == "E":
+                raise OSError(f[2].decode(errors="replace"))
+            if f[0] in kinds:
+                return f
+        raise TimeoutError("no reply from device")
+
+    def put(self, local, remote):
+        with open(local, "rb") as f:
+            return self._push(f, os.fstat(f.fileno()).st_size, remote)
+
+    def _push(self, f, size, remote):
+        if size > 0xFFFFFFFF:
+            raise ValueError("file too large (4 GiB limit)")
+        self.send("P", 0, struct.pack("<I", size) + remote.encode())
+        self.expect("A")
+        last = (size + CHUNK - 1) // CHUNK
+        base = nxt = 1
+        retries = 0
+        while base <= last:
+            while nxt <= last and nxt < base + WINDOW:
+                f.seek((nxt - 1) * CHUNK)
+                self.send("D", nxt, f.read(CHUNK))
+                nxt += 1
+            reply = self.recv()
+            if reply is None:
+                retries += 1
+                if retries > RETRIES:
+                    self.send("X", 0)
+                    raise TimeoutError("device stopped acking")
+                nxt = base
+            elif reply[0] == "A" and reply[1] >= base:
+                base, retries = reply[1] + 1, 0
+            elif reply[0] == "N":
+                nxt = max(reply[1], base)
+            elif reply[0] == "E":
+                raise OSError(reply[2].decode(errors="replace"))
+        return size
+
+    def _pull(self, kind, remote, out):
+        self.send(kind, 0, remote.encode())
+        size = struct.unpack("<I", self.expect("S")[2])[0]
+        expect, got = 1, 0
+        while got < size:
+            f = self.expect("D")
+            if f[1] == expect:
+                out.write(f[2])
+                got += len(f[2])
+                expect += 1
+                self.send("A", f[1])
+            elif f[1] < expect:
+                self.send("A", expect - 1)
+            else:
+                self.send("N", expect)
+        return got
+
+    def get(self, remote, local):
+        with open(local, "wb") as f:
+            return self._pull("G", remote, f)
+
+    def ls(self, remote):
+        import io
+        buf = io.BytesIO()
+        self._pull("L", remote, buf)
+        return buf.getvalue().decode().split("\n") if buf.getvalue() else []
+
+    def stat(self, remote):
+        self.send("T", 0, remote.encode())
+        is_dir, size = struct.unpack("<BI", self.expect("R")[2])
+        return bool(is_dir), size
+
+
+def main(argv):
+    if len(argv) < 3:
+        print(__doc__)
+        return 2
+    link = Link(argv[1])
+    cmd, rest = argv[2], argv[3:]
+    start = time.monotonic()
+    if cmd == "put" and len(rest) == 2:
+        n = link.put(rest[0], rest[1])
+    elif cmd == "get" and len(rest) == 2:
+        n = link.get(rest[0], rest[1])
+    elif cmd == "ls":
+        for name in link.ls(rest[0] if rest else "/"):
+            print(name)
+        return 0
+    elif cmd == "stat" and len(rest) == 1:
+        is_dir, size = link.stat(rest[0])
+        print(f"{'dir' if is_dir else 'file'} {size}")
+        return 0
+    else:
+        print(__doc__)
+        return 2
+    dt = time.monotonic() - start
+    print(f"{n} B in {dt:.2f}s ({n / dt / 1024 if dt else 0:.1f} KB/s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))